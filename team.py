@@ -1,9 +1,21 @@
 import os
+import re
+import json
 import time
-import requests
+import asyncio
+import pickle
+import logging
+import random
+import hashlib
+import tempfile
+import threading
+import functools
+from concurrent.futures import Future
+import httpx
+from cachetools import TTLCache
+from pathlib import Path
 from typing import Optional
 from phi.tools.googlecalendar import GoogleCalendarTools
-import datetime
 from tzlocal import get_localzone_name
 from phi.utils.log import logger
 from phi.agent import Agent
@@ -12,14 +24,225 @@ from phi.tools.zoom import ZoomTool
 from phi.tools.slack import SlackTools
 from dotenv import load_dotenv
 
-load_dotenv()
+# Skip the .env lookup only when every variable this module needs is already set
+REQUIRED_ENV = ("ZOOM_ACCOUNT_ID", "ZOOM_CLIENT_ID", "ZOOM_CLIENT_SECRET", "SLACK_TOKEN", "OPENAI_API_KEY")
+if not all(os.environ.get(var) for var in REQUIRED_ENV):
+    load_dotenv()
 # Get environment variables
 ACCOUNT_ID = os.getenv("ZOOM_ACCOUNT_ID")
 CLIENT_ID = os.getenv("ZOOM_CLIENT_ID")
 CLIENT_SECRET = os.getenv("ZOOM_CLIENT_SECRET")
 
+# Agent debug output and tool-call echoing are opt-in via PHI_DEBUG=1 (or phi's own PHI_DEBUG=true)
+DEBUG = os.getenv("PHI_DEBUG", "").lower() in ("1", "true")
+
+
+def _build_agent(**kwargs) -> Agent:
+    """
+    Build an Agent with debug_mode=DEBUG. phi resets its logger to INFO whenever an Agent is created
+    without debug mode, so the WARNING level is re-applied afterwards.
+    """
+    agent = Agent(debug_mode=DEBUG, **kwargs)
+    if not DEBUG:
+        logger.setLevel(logging.WARNING)
+    return agent
+
+# Read-only tool results are reused for a short window; each provider has its own namespace
+TOOL_CACHE_TTL = 30
+_TOOL_CACHES = {}
+_TOOL_CACHE_LOCK = threading.RLock()
+
+
+def _tool_cache(namespace: str) -> TTLCache:
+    with _TOOL_CACHE_LOCK:
+        if namespace not in _TOOL_CACHES:
+            _TOOL_CACHES[namespace] = TTLCache(maxsize=256, ttl=TOOL_CACHE_TTL)
+        return _TOOL_CACHES[namespace]
+
+
+def _tenant(tool) -> object:
+    """Identify whose data a tool call returns, so accounts sharing a process never share cached results."""
+    return getattr(tool, "_token_key", None) or id(tool)
+
+
+def ttl_cache(namespace: str):
+    """Cache a read-only tool method's result per (method, args) for TOOL_CACHE_TTL seconds. Errors are not cached."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache = _tool_cache(namespace)
+            key = (_tenant(self), func.__name__, args, tuple(sorted(kwargs.items())))
+            with _TOOL_CACHE_LOCK:
+                if key in cache:
+                    return cache[key]
+            result = func(self, *args, **kwargs)
+            if not str(result).startswith('{"error"'):
+                with _TOOL_CACHE_LOCK:
+                    cache[key] = result
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def invalidates_cache(namespace: str):
+    """Clear the namespace's cached reads after a mutating tool method runs."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                with _TOOL_CACHE_LOCK:
+                    _tool_cache(namespace).clear()
+
+        return wrapper
+
+    return decorator
+
+
+# Per-provider concurrency caps keep agent fan-out below each API's rate limit
+_PROVIDER_SEMAPHORES = {
+    "zoom": threading.BoundedSemaphore(4),
+    "slack": threading.BoundedSemaphore(3),
+    "google_calendar": threading.BoundedSemaphore(5),
+}
+RATE_LIMIT_RETRIES = 3
+_RATE_LIMIT_ERROR = re.compile(r"\b429\b|ratelimited|rate ?limit", re.I)
+
+
+def rate_limited(namespace: str):
+    """Run a tool method under its provider's concurrency cap, backing off with full jitter when throttled."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            for attempt in range(RATE_LIMIT_RETRIES + 1):
+                with _PROVIDER_SEMAPHORES[namespace]:
+                    result = func(self, *args, **kwargs)
+                # The toolkits report failures as {"error": ...} strings rather than raising
+                throttled = str(result).startswith('{"error"') and _RATE_LIMIT_ERROR.search(str(result))
+                if not throttled or attempt == RATE_LIMIT_RETRIES:
+                    return result
+                delay = random.uniform(0, 2**attempt)
+                logger.warning(f"{namespace} is rate limiting {func.__name__}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def coalesce(namespace: str):
+    """Let concurrent identical tool calls share one upstream request; later callers wait for the first one's result."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                payload = pickle.dumps((namespace, _tenant(self), func.__name__, args, sorted(kwargs.items())))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                return func(self, *args, **kwargs)
+            key = hashlib.blake2b(payload, digest_size=16).hexdigest()
+            with _INFLIGHT_LOCK:
+                future = _INFLIGHT.get(key)
+                leader = future is None
+                if leader:
+                    future = _INFLIGHT[key] = Future()
+            if not leader:
+                return future.result()
+            try:
+                future.set_result(func(self, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with _INFLIGHT_LOCK:
+                    _INFLIGHT.pop(key, None)
+            return future.result()
+
+        return wrapper
+
+    return decorator
+
+
+def read_tool(namespace: str, func):
+    """Wrap a read-only tool method: TTL cache, then in-flight coalescing, then the provider's rate limit."""
+    return ttl_cache(namespace)(coalesce(namespace)(rate_limited(namespace)(func)))
+
+
+def write_tool(namespace: str, func):
+    """Wrap a mutating tool method: the provider's rate limit, then invalidation of its cached reads."""
+    return invalidates_cache(namespace)(rate_limited(namespace)(func))
+
+
+# Zoom OAuth traffic shares one event loop thread and one pooled keep-alive client
+_ZOOM_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_ZOOM_LOOP.run_forever, name="zoom-loop", daemon=True).start()
+_ZOOM_HTTP = httpx.AsyncClient(
+    timeout=httpx.Timeout(10, connect=3.05),
+    headers={"Connection": "keep-alive"},
+    transport=httpx.AsyncHTTPTransport(
+        retries=2, limits=httpx.Limits(max_connections=8, max_keepalive_connections=4)
+    ),
+)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest Retry-After we wait out; sync tool calls block on the token fetch, so longer waits fail fast instead
+MAX_RETRY_AFTER = 10
+# Refresh the Zoom token in the background this many seconds before it is due to expire
+TOKEN_SOFT_REFRESH = 300
+# Per-user directory for persisted Zoom tokens, kept out of the shared temp directory
+TOKEN_CACHE_DIR = Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "zoom_tool"
+# Tokens shared by every CustomZoomTool in the process, keyed by _cred_key(): (access_token, monotonic deadline)
+_TOKEN_CACHE = {}
+_TOKEN_LOCKS = {}
+# How far a cached token's issue time may be ahead of the wall clock before the cache is distrusted
+TOKEN_CLOCK_SKEW = 60
+
+
+async def _post_with_retry(url: str, total: int = 2, backoff_factor: float = 0.2, **kwargs) -> httpx.Response:
+    """POST on the shared Zoom client, retrying transient statuses with backoff and honoring Retry-After."""
+    for attempt in range(total + 1):
+        response = await _ZOOM_HTTP.post(url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == total:
+            return response
+        delay = backoff_factor * 2**attempt
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            if int(retry_after) > MAX_RETRY_AFTER:
+                logger.warning(f"Zoom asked to retry after {retry_after}s, longer than {MAX_RETRY_AFTER}s; giving up")
+                return response
+            delay = max(delay, int(retry_after))
+        logger.warning(f"Zoom returned {response.status_code}, retrying in {delay}s")
+        await asyncio.sleep(delay)
+    return response
+
 
 class CustomZoomTool(ZoomTool):
+    # ZoomTool registers these by attribute name, so the wrapped versions are what the agent calls
+    schedule_meeting = write_tool("zoom", ZoomTool.schedule_meeting)
+    delete_meeting = write_tool("zoom", ZoomTool.delete_meeting)
+    get_upcoming_meetings = read_tool("zoom", ZoomTool.get_upcoming_meetings)
+    list_meetings = read_tool("zoom", ZoomTool.list_meetings)
+    get_meeting = read_tool("zoom", ZoomTool.get_meeting)
+    get_meeting_recordings = read_tool("zoom", ZoomTool.get_meeting_recordings)
+
+    @property
+    def _ZoomTool__access_token(self) -> Optional[str]:
+        """ZoomTool's private token attribute, backed by access_token so there is a single copy."""
+        return self.access_token
+
+    @_ZoomTool__access_token.setter
+    def _ZoomTool__access_token(self, token: Optional[str]) -> None:
+        self.access_token = token
+
     def __init__(
         self,
         account_id: Optional[str] = None,
@@ -30,22 +253,130 @@ class CustomZoomTool(ZoomTool):
         super().__init__(account_id=account_id, client_id=client_id, client_secret=client_secret, name=name)
         self.token_url = "https://zoom.us/oauth/token"
         self.access_token = None
-        self.token_expires_at = 0
+        # Deadlines use time.monotonic(); wall-clock time is only used for the on-disk cache
+        self.token_expires_at = 0.0
+        self._soft_refresh_at = 0.0
+        self._refreshing = False
+        self._token_key = self._cred_key()
+        # Token refreshes run on the Zoom event loop so sync tool calls and async callers share one in-flight request;
+        # instances with the same credentials share the lock as well
+        self._token_lock = _TOKEN_LOCKS.setdefault(self._token_key, asyncio.Lock())
+        self.token_cache_path = TOKEN_CACHE_DIR / f"{self._token_key}.json"
+        if not self._adopt_shared_token():
+            self._load_cached_token()
+
+    def _cred_key(self) -> str:
+        """SHA-256 of the credentials, so the secret never appears in cache keys, filenames or logs."""
+        parts = [self.account_id or "", self.client_id or "", self.client_secret or ""]
+        return hashlib.sha256(b"\0".join(part.encode() for part in parts)).hexdigest()
+
+    def _adopt_shared_token(self) -> bool:
+        """Pick up a newer token fetched by another instance with the same credentials."""
+        cached = _TOKEN_CACHE.get(self._token_key)
+        if cached is None or cached[1] <= max(time.monotonic(), self.token_expires_at):
+            return False
+        self.access_token, deadline = cached
+        self._set_token_deadline(deadline - time.monotonic())
+        return True
+
+    def _publish_token(self) -> None:
+        _TOKEN_CACHE[self._token_key] = (self.access_token, self.token_expires_at)
+
+    def _load_cached_token(self) -> None:
+        """Reuse a still-valid token persisted by a previous run."""
+        now = time.time()
+        try:
+            with open(self.token_cache_path) as f:
+                # Only trust a file that this user owns and nobody else can read or write
+                st = os.fstat(f.fileno())
+                if (hasattr(os, "getuid") and st.st_uid != os.getuid()) or st.st_mode & 0o077:
+                    logger.warning(f"Ignoring Zoom token cache {self.token_cache_path}: wrong owner or permissions")
+                    return
+                cached = json.load(f)
+            issued_at, expires_at = cached["issued_at"], cached["expires_at"]
+            # Never trust the cache for longer than the token's own lifetime, even if the wall clock moved back
+            remaining = min(expires_at - now, expires_at - issued_at)
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if issued_at > now + TOKEN_CLOCK_SKEW:
+            logger.warning("Ignoring Zoom token cache written in the future; the system clock has moved back")
+            return
+        if remaining > 0:
+            self.access_token = cached["access_token"]
+            self._set_token_deadline(remaining)
+            self._publish_token()
+
+    def _save_cached_token(self, expires_in: int) -> None:
+        """Atomically persist the current token with its wall-clock expiry, readable only by the owner."""
+        now = time.time()
+        payload = {"access_token": self.access_token, "issued_at": now, "expires_at": now + expires_in - 60}
+        tmp = None
+        try:
+            self.token_cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # mkstemp creates the file with mode 0600
+            fd, tmp = tempfile.mkstemp(dir=self.token_cache_path.parent, prefix=".zoom_", suffix=".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp, self.token_cache_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not persist Zoom token cache: {e}")
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _set_token_deadline(self, seconds_left: float) -> None:
+        self.token_expires_at = time.monotonic() + seconds_left
+        self._soft_refresh_at = self.token_expires_at - TOKEN_SOFT_REFRESH
+
+    def _token_is_valid(self) -> bool:
+        return bool(self.access_token) and time.monotonic() < self.token_expires_at
+
+    def _token_needs_refresh(self) -> bool:
+        return not self._token_is_valid() or time.monotonic() >= self._soft_refresh_at
 
     def get_access_token(self) -> str:
         """
         Obtain or refresh the access token for Zoom API.
+        Sync wrapper used by ZoomTool's tool methods; the refresh itself runs on the tool's event loop.
         Returns:
             A string containing the access token or an empty string if token retrieval fails.
         """
-        if self.access_token and time.time() < self.token_expires_at:
+        if self._token_is_valid():
+            self.prefetch_access_token()
+            return str(self.access_token)
+        return asyncio.run_coroutine_threadsafe(self._refresh_access_token(), _ZOOM_LOOP).result()
+
+    async def aget_access_token(self) -> str:
+        """Async variant of get_access_token for callers already running in an event loop."""
+        if self._token_is_valid():
+            self.prefetch_access_token()
+            return str(self.access_token)
+        future = asyncio.run_coroutine_threadsafe(self._refresh_access_token(), _ZOOM_LOOP)
+        return await asyncio.wrap_future(future)
+
+    def prefetch_access_token(self) -> None:
+        """Start a token refresh in the background if the token is missing or close to expiry, without waiting for it."""
+        if self._token_needs_refresh() and not self._refreshing:
+            self._refreshing = True
+            asyncio.run_coroutine_threadsafe(self._refresh_access_token(), _ZOOM_LOOP)
+
+    async def _refresh_access_token(self) -> str:
+        """Fetch a new token, letting concurrent callers wait on the same request instead of issuing their own."""
+        async with self._token_lock:
+            try:
+                return await self._fetch_access_token()
+            finally:
+                self._refreshing = False
+
+    async def _fetch_access_token(self) -> str:
+        self._adopt_shared_token()
+        if not self._token_needs_refresh():
             return str(self.access_token)
 
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         data = {"grant_type": "account_credentials", "account_id": self.account_id}
 
         try:
-            response = requests.post(
+            response = await _post_with_retry(
                 self.token_url, headers=headers, data=data, auth=(self.client_id, self.client_secret)
             )
             response.raise_for_status()
@@ -53,32 +384,36 @@ class CustomZoomTool(ZoomTool):
             token_info = response.json()
             self.access_token = token_info["access_token"]
             expires_in = token_info["expires_in"]
-            self.token_expires_at = time.time() + expires_in - 60
+            self._set_token_deadline(expires_in - 60)
 
-            self._set_parent_token(str(self.access_token))
+            self._publish_token()
+            self._save_cached_token(expires_in)
+            logger.debug(f"Fetched Zoom access token for credentials {self._token_key[:8]}")
             return str(self.access_token)
-        except requests.RequestException as e:
-            logger.error(f"Error fetching access token: {e}")
-            return ""
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            logger.error(f"Error fetching access token for credentials {self._token_key[:8]}: {e}")
+            # A failed early refresh leaves the current token in use until it actually expires
+            return str(self.access_token) if self._token_is_valid() else ""
+
 
-    def _set_parent_token(self, token: str) -> None:
-        """Helper method to set the token in the parent ZoomTool class"""
-        if token:
-            self._ZoomTool__access_token = token
+class CachedGoogleCalendarTools(GoogleCalendarTools):
+    list_events = read_tool("google_calendar", GoogleCalendarTools.list_events)
+    create_event = write_tool("google_calendar", GoogleCalendarTools.create_event)
 
 
-zoom_tools = CustomZoomTool(account_id=ACCOUNT_ID, client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
+class CachedSlackTools(SlackTools):
+    list_channels = read_tool("slack", SlackTools.list_channels)
+    get_channel_history = read_tool("slack", SlackTools.get_channel_history)
+    send_message = write_tool("slack", SlackTools.send_message)
 
 
-zoom_agent = Agent(
-    name="Zoom Meeting Manager",
-    agent_id="zoom-meeting-manager",
-    model=OpenAIChat(model="gpt-4"),
-    tools=[zoom_tools],
-    markdown=True,
-    debug_mode=True,
-    show_tool_calls=True,
-    instructions=[
+@functools.cache
+def get_zoom_tools() -> CustomZoomTool:
+    return CustomZoomTool(account_id=ACCOUNT_ID, client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
+
+
+ZOOM_INSTRUCTIONS = "\n".join(
+    [
         "You are an expert at managing Zoom meetings using the Zoom API.",
         "You can:",
         "1. Schedule new meetings (schedule_meeting)",
@@ -99,42 +434,56 @@ zoom_agent = Agent(
         "- Provide meeting details after scheduling (ID, URL, time)",
         "- Handle errors gracefully",
         "- Confirm successful operations",
-    ],
+    ]
 )
 
 
+@functools.cache
+def get_zoom_agent() -> Agent:
+    return _build_agent(
+        name="Zoom Meeting Manager",
+        agent_id="zoom-meeting-manager",
+        model=OpenAIChat(model="gpt-4"),
+        tools=[get_zoom_tools()],
+        markdown=True,
+        show_tool_calls=DEBUG,
+        instructions=ZOOM_INSTRUCTIONS,
+    )
+
+
 # Define Google Calendar Assistant Agent
 # Define Google Calendar Assistant Agent
-calendar_agent = Agent(
-    name="Google Calendar Assistant",
-    agent_id="google-calendar-assistant",
-    model=OpenAIChat(model="gpt-4"),
-    tools=[GoogleCalendarTools(credentials_path="client_secret_assistant.json")],
-    show_tool_calls=True,
-    instructions=[
-        f"""
-        You are a scheduling assistant. Today is {datetime.datetime.now()} and the user's timezone is {get_localzone_name()}.
-        Your tasks include:
-        - Retrieving scheduled events from Google Calendar.
-        - Creating new calendar events based on user input.
-        """,
-    ],
-    add_datetime_to_instructions=True,
-)
+CALENDAR_INSTRUCTIONS = """
+You are a scheduling assistant. The user's timezone is {timezone}.
+Your tasks include:
+- Retrieving scheduled events from Google Calendar.
+- Creating new calendar events based on user input.
+"""
+
+
+@functools.cache
+def get_calendar_agent() -> Agent:
+    return _build_agent(
+        name="Google Calendar Assistant",
+        agent_id="google-calendar-assistant",
+        model=OpenAIChat(model="gpt-4"),
+        tools=[CachedGoogleCalendarTools(credentials_path="client_secret_assistant.json")],
+        show_tool_calls=DEBUG,
+        instructions=CALENDAR_INSTRUCTIONS.format(timezone=get_localzone_name()),
+        # phi stamps the current time on every run, so "today" stays correct in a long-lived process
+        add_datetime_to_instructions=True,
+    )
 
 
 # Define Slack Tool
-slack_tools = SlackTools()
+@functools.cache
+def get_slack_tools() -> CachedSlackTools:
+    return CachedSlackTools()
+
 
 # Define Slack Communication Agent
-slack_agent = Agent(
-    name="Slack Communication Manager",
-    agent_id="slack-communication-manager",
-    tools=[SlackTools()],
-    show_tool_calls=True,
-    markdown=True,
-    debug_mode=True,
-    instructions=[
+SLACK_INSTRUCTIONS = "\n".join(
+    [
         "You are responsible for managing Slack communications.",
         "You can perform the following tasks:",
         "- Send messages to Slack channels or users",
@@ -146,63 +495,288 @@ slack_agent = Agent(
         "- Ensure messages are formatted correctly in Markdown when needed.",
         "- Confirm successful message delivery and provide response summaries.",
         "- Use clear and concise messaging to improve communication.",
-    ],
+    ]
 )
 
 
+@functools.cache
+def get_slack_agent() -> Agent:
+    return _build_agent(
+        name="Slack Communication Manager",
+        agent_id="slack-communication-manager",
+        tools=[get_slack_tools()],
+        show_tool_calls=DEBUG,
+        markdown=True,
+        instructions=SLACK_INSTRUCTIONS,
+    )
+
+
 
 
 # Define Team Leader Agent
 # Define Team Leader Agent
-team_leader_agent = Agent(
-    name="Team Leader",
-    agent_id="team-leader",
-    model=OpenAIChat(model="gpt-4"),
-    tools=[],
-    markdown=True,
-    debug_mode=True,
-    show_tool_calls=True,
-    instructions=[
-        "You are responsible for delegating tasks to the appropriate agent(s) in the Scheduling Team.",
+TEAM_LEADER_INSTRUCTIONS = "\n".join(
+    [
+        "You are responsible for planning which agent(s) in the Scheduling Team handle a request.",
         "Your goal is to optimize performance by selecting the correct agent(s) for each request while minimizing unnecessary API calls.",
         "",
+        "Available agents:",
+        "- zoom: the Zoom Meeting Manager (scheduling, listing, retrieving recordings, deleting meetings).",
+        "- calendar: the Google Calendar Assistant (getting events, adding events).",
+        "- slack: the Slack Communication Manager (sending messages, retrieving messages, notifying users).",
+        "",
         "Rules for Delegation:",
-        "- If the request is ONLY about Zoom meetings (scheduling, listing, retrieving recordings, etc.), delegate to the **Zoom Meeting Manager** and ignore the other agents.",
-        "- If the request is ONLY about Google Calendar (getting events, adding events, modifying events), delegate to the **Google Calendar Assistant** and ignore the other agents.",
-        "- If the request is ONLY about Slack (sending messages, retrieving messages, notifying users), delegate to the **Slack Communication Manager** and ignore the other agents.",
-        "- If the request involves BOTH Zoom and Google Calendar (e.g., scheduling a Zoom meeting and adding it to Google Calendar), first call the **Zoom Meeting Manager**, retrieve meeting details, then pass those details to the **Google Calendar Assistant**.",
-        "- If the request involves notifying users on Slack after scheduling a Zoom meeting or adding a Google Calendar event, first complete the scheduling task, then pass relevant details to the **Slack Communication Manager**.",
+        "- If the request is ONLY about one service, list only that agent and ignore the other agents.",
+        "- Use \"order\": \"parallel\" when the agents' tasks do not need each other's output (e.g. listing Zoom meetings AND reading Slack messages); they run at the same time.",
+        "- Use \"order\": \"sequential\" when a task needs an earlier agent's output; agents run in the listed order and each receives every earlier result as context.",
+        "- If the request involves BOTH Zoom and Google Calendar (e.g., scheduling a Zoom meeting and adding it to Google Calendar), list zoom before calendar.",
+        "- If the request involves notifying users on Slack after scheduling a Zoom meeting or adding a Google Calendar event, list slack after the scheduling agent.",
+        "- Each agent appears at most once in \"agents\".",
         "",
         "Additional Guidelines:",
         "- Ensure correct agent selection to avoid unnecessary API calls.",
-        "- Provide users with clear responses based on the selected agent(s).",
-        "- Confirm task completion after execution.",
-        "- If a Zoom meeting or calendar event is scheduled, ask the user if they want to notify participants via Slack before triggering the Slack Agent.",
-        "- If a task is unclear, request clarification before delegating.",
-    ],
+        "- Only include slack when the user asked for a Slack message or notification.",
+        "- Write each subprompt as a complete instruction the agent can carry out on its own.",
+        "- If a task is unclear, leave \"agents\" empty and put your question in \"clarification\".",
+        "",
+        "Respond ONLY with a JSON object matching:",
+        '{"agents": ["zoom" | "calendar" | "slack", ...], "order": "parallel" | "sequential", "subprompts": {"<agent>": "<task for that agent>"}, "clarification": null | "<question>"}',
+        "",
+        "Examples:",
+        'Request: "List all my upcoming Zoom meetings" -> {"agents": ["zoom"], "order": "parallel", "subprompts": {"zoom": "List all my upcoming Zoom meetings."}, "clarification": null}',
+        'Request: "Show my Zoom recordings and the last 5 messages in #general" -> {"agents": ["zoom", "slack"], "order": "parallel", "subprompts": {"zoom": "List my Zoom meeting recordings.", "slack": "Get the last 5 messages of the Slack channel general."}, "clarification": null}',
+        'Request: "Schedule a Zoom standup tomorrow at 10 AM for 30 mins, add it to my calendar and post it in #team" -> {"agents": ["zoom", "calendar", "slack"], "order": "sequential", "subprompts": {"zoom": "Schedule a 30 minute Zoom meeting titled Standup tomorrow at 10 AM.", "calendar": "Create a calendar event for the scheduled Zoom standup, including its join URL.", "slack": "Post the standup meeting details to the Slack channel team."}, "clarification": null}',
+    ]
 )
 
 
+@functools.cache
+def get_team_leader_agent() -> Agent:
+    return _build_agent(
+        name="Team Leader",
+        agent_id="team-leader",
+        # Routing is a classification task, so the cheaper and faster model is enough here
+        model=OpenAIChat(model="gpt-4o-mini", response_format={"type": "json_object"}),
+        tools=[],
+        markdown=False,
+        show_tool_calls=DEBUG,
+        instructions=TEAM_LEADER_INSTRUCTIONS,
+    )
+
+
+# Agents are built on first use, so a plan only constructs the agents it delegates to
+PLAN_AGENTS = {"zoom": get_zoom_agent, "calendar": get_calendar_agent, "slack": get_slack_agent}
+
+
 # Create a Team in Phi Data
-scheduling_team = Agent(
-    name="Scheduling Team",
-    team=[team_leader_agent, zoom_agent, calendar_agent,slack_agent],
-    instructions="Handles Zoom meetings, Google Calendar scheduling and Slack Communication.",
-    show_tool_calls=True,
-    markdown=True,
-)
+@functools.cache
+def get_scheduling_team() -> Agent:
+    return _build_agent(
+        name="Scheduling Team",
+        team=[get_zoom_agent(), get_calendar_agent(), get_slack_agent()],
+        instructions="Handles Zoom meetings, Google Calendar scheduling and Slack Communication.",
+        show_tool_calls=DEBUG,
+        markdown=True,
+    )
+
+
+@functools.cache
+def get_batch_team() -> Agent:
+    """Scheduling Team variant for run_batch, constrained to plain JSON replies so rows can be split reliably."""
+    return _build_agent(
+        name="Scheduling Batch Team",
+        # json_object mode needs a model newer than gpt-4
+        model=OpenAIChat(model="gpt-4o", response_format={"type": "json_object"}),
+        team=[get_zoom_agent(), get_calendar_agent(), get_slack_agent()],
+        instructions="Handles Zoom meetings, Google Calendar scheduling and Slack Communication.",
+        show_tool_calls=DEBUG,
+        markdown=False,
+    )
+
+
+def _plan_levels(plan: dict) -> list:
+    """Turn the Team Leader's plan into levels; steps within a level have no dependency on each other."""
+    if plan["order"] not in ("parallel", "sequential"):
+        raise ValueError(f"unknown plan order {plan['order']!r}")
+    steps = [{"agent": agent_name, "task": plan["subprompts"][agent_name]} for agent_name in dict.fromkeys(plan["agents"])]
+    if not steps and not plan.get("clarification"):
+        raise ValueError("plan has no agents and no clarification")
+    if plan["order"] == "parallel":
+        return [steps] if steps else []
+    return [[step] for step in steps]
+
+
+# Agent names appear as quoted strings in the plan's "agents" list and "subprompts" keys
+_PLAN_AGENT_PATTERN = re.compile(r'"(zoom|calendar|slack)"')
+
+
+def _prewarm(agent_name: str) -> None:
+    """Build a planned agent, and start its token fetch, while the rest of the plan is still streaming."""
+    PLAN_AGENTS[agent_name]()
+    if agent_name == "zoom":
+        get_zoom_tools().prefetch_access_token()
+
+
+async def _stream_plan(user_request: str) -> str:
+    """Stream the Team Leader's plan, warming up each agent as soon as it is named."""
+    plan_text = ""
+    warmed = set()
+    async for chunk in await get_team_leader_agent().arun(user_request, stream=True):
+        plan_text += chunk.content or ""
+        for agent_name in set(_PLAN_AGENT_PATTERN.findall(plan_text)) - warmed:
+            warmed.add(agent_name)
+            _prewarm(agent_name)
+    return plan_text
+
+
+async def run_plan(user_request: str) -> str:
+    """
+    Ask the Team Leader for a delegation plan and execute it, running independent steps concurrently.
+    Falls back to the Scheduling Team if the plan cannot be parsed.
+    """
+    try:
+        plan = json.loads(await _stream_plan(user_request))
+        levels = _plan_levels(plan)
+        if any(step["agent"] not in PLAN_AGENTS for level in levels for step in level):
+            raise ValueError("unknown agent in plan")
+    except (TypeError, ValueError, KeyError, AttributeError) as e:
+        logger.warning(f"Could not use Team Leader plan ({e}); falling back to the Scheduling Team")
+        return (await get_scheduling_team().arun(user_request)).content
+
+    if plan.get("clarification") and not levels:
+        return plan["clarification"]
+
+    results = []
+    for level in levels:
+        context = "\n\n".join(results)
+        prompts = [f"{step['task']}\n\nResults from previous steps:\n{context}" if context else step["task"] for step in level]
+        # phi runs tool calls synchronously even inside arun, so each agent gets its own thread to keep the
+        # Zoom, Calendar and Slack requests of a level in flight at the same time
+        responses = await asyncio.gather(
+            *[asyncio.to_thread(PLAN_AGENTS[step["agent"]]().run, prompt) for step, prompt in zip(level, prompts)]
+        )
+        results.extend(str(r.content) for r in responses)
+    return "\n\n".join(results)
+
+
+# Keyword routes for requests that obviously target a single service
+_ROUTES = [
+    (re.compile(r"\bzoom\b|\brecordings?\b|\bmeetings?\b", re.I), "zoom"),
+    (re.compile(r"\bcalendar\b|\bevents?\b", re.I), "calendar"),
+    (re.compile(r"\bslack\b|\bchannels?\b|\bmessages?\b", re.I), "slack"),
+]
+
+
+async def dispatch(user_request: str) -> str:
+    """Send single-service requests straight to their agent, skipping the Team Leader; plan everything else."""
+    matched = [agent_name for pattern, agent_name in _ROUTES if pattern.search(user_request)]
+    if len(matched) == 1:
+        logger.debug(f"Routing request directly to {matched[0]}")
+        _prewarm(matched[0])
+        return str((await PLAN_AGENTS[matched[0]]().arun(user_request)).content)
+    return await run_plan(user_request)
+
+
+# Batches beyond ~8 rows stop paying off and make a single malformed reply more costly
+MAX_BATCH_ROWS = 8
+BATCH_WINDOW = 0.05
+
+
+def _batch_prompt(user_requests: list) -> str:
+    rows = "\n".join(f"{i}. {request}" for i, request in enumerate(user_requests, start=1))
+    return (
+        "Answer each numbered task independently and respond ONLY with a JSON object of the form "
+        f'{{"results": [{{"id": 1, "result": "..."}}, ...]}}:\n{rows}'
+    )
+
+
+def _parse_batch_response(content: str, rows: int) -> list:
+    """Map a marshaled reply back to its rows; raises ValueError if any row is missing."""
+    text = str(content).strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    by_id = {int(item["id"]): str(item["result"]) for item in json.loads(text)["results"]}
+    if set(by_id) != set(range(1, rows + 1)):
+        raise ValueError(f"expected ids 1..{rows}, got {sorted(by_id)}")
+    return [by_id[i] for i in range(1, rows + 1)]
+
+
+def run_batch(user_requests: list) -> list:
+    """
+    Answer several requests with one batch team run per MAX_BATCH_ROWS rows instead of one run each.
+    If a chunk's reply cannot be mapped back to its rows, every row in it gets the raw reply. The rows are
+    never re-run, because the batched run has already executed their tool calls.
+    """
+    results = []
+    for start in range(0, len(user_requests), MAX_BATCH_ROWS):
+        chunk = user_requests[start : start + MAX_BATCH_ROWS]
+        response = get_batch_team().run(_batch_prompt(chunk))
+        try:
+            results.extend(_parse_batch_response(response.content, len(chunk)))
+        except (TypeError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f"Could not split batched response ({e}); returning the raw reply for {len(chunk)} requests")
+            results.extend([str(response.content)] * len(chunk))
+    return results
+
+
+class RequestBatcher:
+    """Coalesces requests submitted within BATCH_WINDOW seconds into a single run_batch call."""
+
+    def __init__(self, window: float = BATCH_WINDOW, max_rows: int = MAX_BATCH_ROWS):
+        self.window = window
+        self.max_rows = max_rows
+        self._pending = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # The Scheduling Team agent keeps per-run state, so batches run one at a time
+        self._run_lock = asyncio.Lock()
+
+    async def submit(self, user_request: str) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((user_request, future))
+        if len(self._pending) >= self.max_rows:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: list) -> None:
+        async with self._run_lock:
+            try:
+                results = await asyncio.to_thread(run_batch, [request for request, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        for (_, future), result in zip(batch, results):
+            # A caller may have cancelled its submit() while the batch was running
+            if not future.done():
+                future.set_result(result)
+
+
+# Start fetching the Zoom token now so the first Zoom request finds it cached; set ZOOM_PREFETCH=0 to disable
+if os.getenv("ZOOM_PREFETCH", "1") == "1" and ACCOUNT_ID:
+    get_zoom_tools().prefetch_access_token()
 
 # Example Usage
-#user_request = "Schedule a Zoom meeting titled daily Standup for 30mins on February 25 2025 at 11.30 AM for Sri Lankan Time and add this event to my Google Calander as well"
+if __name__ == "__main__":
+    #user_request = "Schedule a Zoom meeting titled daily Standup for 30mins on February 25 2025 at 11.30 AM for Sri Lankan Time and add this event to my Google Calander as well"
 
-user_request="List all my upcoming Zoom meetings"
+    user_request="List all my upcoming Zoom meetings"
 
-#user_request="Create an event in Google Calander on 20th February 2025 at 6PM with the topic Crew AI Learning. This event details should be sent to the slack channel called all-softworldpro"
-#user_request="get the last 10 messages of slack channel all-softworldpro and crate a zoom meeting by using last message details. timezone is Sri Lanka."
-#scheduling_team.print_response(user_request,stream=True)
+    #user_request="Create an event in Google Calander on 20th February 2025 at 6PM with the topic Crew AI Learning. This event details should be sent to the slack channel called all-softworldpro"
+    #user_request="get the last 10 messages of slack channel all-softworldpro and crate a zoom meeting by using last message details. timezone is Sri Lanka."
+    #get_scheduling_team().print_response(user_request,stream=True)
 
 
-response = scheduling_team.run(user_request)
+    response = asyncio.run(dispatch(user_request))
 
 
-print(f'Below is the OUTPUT:========  {response.content}')
\ No newline at end of file
+    print(f'Below is the OUTPUT:========  {response}')